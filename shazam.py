@@ -1,18 +1,32 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import scipy.ndimage
-import matplotlib.mlab as mlab
 import librosa
 import sqlite3
-import hashlib
-from typing import List, Tuple, Any, Dict # For type hinting
+from typing import List, Tuple, Any # For type hinting
+
+try:
+    import numba
+except ImportError: # Numba is optional; the pure NumPy code paths are used without it
+    numba = None
 
 # --- Configuration Constants ---
-NFFT_VAL = 4096
-NOVERLAP_VAL = 2048  # Typically NFFT / 2
-PEAK_NEIGHBORHOOD_SIZE_VAL = 20 # Size of the neighborhood for peak picking
+TARGET_SR_VAL = 8000 # Sample rate (Hz) audio is resampled to on load; fingerprints live well below 4 kHz
+NFFT_VAL = 1024
+NOVERLAP_VAL = 512  # Typically NFFT / 2
+PEAK_NEIGHBORHOOD_SIZE_VAL = 20 # Diamond radius (bins and frames) of the peak-picking neighborhood; see get_peaks
+PEAK_AMP_RANGE_DB_VAL = 60 # Peaks quieter than (spectrogram max - this many dB) are discarded
 HASH_FAN_VALUE_VAL = 15 # Number of peaks to pair with for hashing
-HASH_TIME_WINDOW_VAL = 200 # Max time difference (frames) between peaks for hashing
+HASH_TIME_WINDOW_VAL = 290 # Max time difference (frames) between peaks for hashing (~18.6 s at 64 ms/frame)
+HASH_FIELD_BITS_VAL = 16 # Bits reserved for each of freq1, freq2 and time_diff in a packed hash
 DB_NAME_VAL = 'fingerprints.db'
+AUDIO_EXTENSIONS_VAL = ('.mp3', '.wav', '.flac', '.ogg', '.m4a') # Files picked up by batch add
+
+# Let NumPy integer scalars be bound as SQLite parameters without an explicit int(...).
+for _np_int_type in (np.int32, np.int64):
+    sqlite3.register_adapter(_np_int_type, int)
 
 # --- Database Functions ---
 
@@ -28,6 +42,15 @@ def init_db(db_name: str = DB_NAME_VAL) -> sqlite3.Connection:
     """
     conn = sqlite3.connect(db_name)
     c = conn.cursor()
+    # Tune SQLite for bulk fingerprint inserts. page_size only takes effect on a new
+    # database and must be set before the first table is created and before WAL is enabled.
+    c.execute("PRAGMA page_size = 4096")
+    c.execute("PRAGMA journal_mode = WAL")  # Commits append to a log instead of rewriting pages
+    c.execute("PRAGMA synchronous = NORMAL")  # Safe with WAL; fsync on checkpoint, not every commit
+    c.execute("PRAGMA cache_size = -65536")  # 64 MB page cache (negative values are KiB)
+    c.execute("PRAGMA temp_store = MEMORY")
+    c.execute("PRAGMA mmap_size = 1073741824")  # Memory-map up to 1 GB of the database file
+    c.execute("PRAGMA busy_timeout = 60000")  # Wait up to 60 s for locks instead of failing
     # Create 'songs' table to store song metadata
     c.execute('''
         CREATE TABLE IF NOT EXISTS songs (
@@ -35,22 +58,64 @@ def init_db(db_name: str = DB_NAME_VAL) -> sqlite3.Connection:
             name TEXT UNIQUE 
         )
     ''') 
-    # Create 'fingerprints' table to store fingerprint hashes associated with songs
+    # Create 'fingerprints' table to store fingerprint hashes associated with songs.
+    # WITHOUT ROWID stores rows inside the hash-first primary-key B-tree, so every row for
+    # a hash sits together and a lookup needs no separate index or rowid indirection.
     c.execute('''
         CREATE TABLE IF NOT EXISTS fingerprints (
-            hash TEXT,
+            hash INTEGER,
             song_id INTEGER,
             offset INTEGER,
             PRIMARY KEY (hash, song_id, offset), 
             FOREIGN KEY(song_id) REFERENCES songs(id)
-        )
+        ) WITHOUT ROWID
     ''') 
     conn.commit()
+
+    # Databases created before hashes were packed integers store SHA-1 hex digests,
+    # which can never match the hashes generated now.
+    c.execute("PRAGMA table_info(fingerprints)")
+    column_types = {row[1]: row[2].upper() for row in c.fetchall()}
+    if column_types.get('hash') == 'TEXT':
+        print(f"Warning: '{db_name}' stores legacy SHA-1 fingerprints, which are incompatible with the current "
+              "integer hashes. Delete the database file and re-add your songs.")
     return conn
 
-def store_fingerprints(conn: sqlite3.Connection, song_name: str, hashes: List[Tuple[str, int]]):
+def _ensure_scratch_tables(c: sqlite3.Cursor) -> None:
+    """
+    Creates the per-connection temp tables used by store_fingerprints and recognize_audio.
+    Temp tables are private to each connection, so this runs before every use; the
+    statements are constant strings, so sqlite3's statement cache prepares them only once.
+    """
+    c.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS fingerprints_staging (
+            hash INTEGER,
+            offset INTEGER
+        )
+    ''')
+    c.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS query_hashes (
+            hash INTEGER,
+            offset INTEGER
+        )
+    ''')
+
+def _rollback_savepoint(conn: sqlite3.Connection, name: str, owns_transaction: bool) -> None:
+    """
+    Undoes the work done since SAVEPOINT name. A transaction this code opened itself is
+    rolled back whole; one the caller already had open is left intact.
+    """
+    if owns_transaction:
+        conn.rollback()
+    else:
+        conn.execute(f"ROLLBACK TO {name}")
+        conn.execute(f"RELEASE {name}")
+
+def store_fingerprints(conn: sqlite3.Connection, song_name: str, hashes: List[Tuple[int, int]]):
     """
     Stores the song and its fingerprints in the database.
+    If the connection already has a transaction open, the work joins it through a
+    savepoint and committing is left to the caller.
 
     Args:
         conn (sqlite3.Connection): Database connection object.
@@ -58,7 +123,12 @@ def store_fingerprints(conn: sqlite3.Connection, song_name: str, hashes: List[Tu
         hashes (list): List of tuples containing hash values and offsets.
     """
     c = conn.cursor()
+    owns_transaction = not conn.in_transaction
     try:
+        if owns_transaction:
+            # Take the write lock up front so the whole ingest is a single transaction.
+            c.execute("BEGIN IMMEDIATE")
+        c.execute("SAVEPOINT store_fingerprints")
         # Check if song already exists
         c.execute("SELECT id FROM songs WHERE name = ?", (song_name,))
         song_row = c.fetchone()
@@ -71,21 +141,24 @@ def store_fingerprints(conn: sqlite3.Connection, song_name: str, hashes: List[Tu
             if song_id is None: 
                  raise sqlite3.Error("Failed to get last row ID after inserting song.")
 
-        
-        fingerprints_to_insert = []
-        for hash_val, offset in hashes:
-            fingerprints_to_insert.append((hash_val, song_id, int(offset)))
-
-        if fingerprints_to_insert:
-            c.executemany("INSERT OR IGNORE INTO fingerprints (hash, song_id, offset) VALUES (?, ?, ?)",
-                          fingerprints_to_insert)
-        conn.commit()
+        if hashes:
+            # Bulk load into the unindexed staging table, then merge into 'fingerprints' in
+            # primary-key order so its B-tree is appended to rather than updated at random.
+            # The (hash, offset) pairs are bound as-is; song_id is bound once in the merge.
+            _ensure_scratch_tables(c)
+            c.executemany("INSERT INTO fingerprints_staging (hash, offset) VALUES (?, ?)", hashes)
+            c.execute("INSERT OR IGNORE INTO fingerprints (hash, song_id, offset) "
+                      "SELECT hash, ?, offset FROM fingerprints_staging ORDER BY hash, offset", (song_id,))
+            c.execute("DELETE FROM fingerprints_staging")
+        c.execute("RELEASE store_fingerprints")
+        if owns_transaction:
+            conn.commit()
     except sqlite3.IntegrityError as ie:
         print(f"Integrity error while storing fingerprints for '{song_name}': {ie}.")
-        conn.rollback() 
+        _rollback_savepoint(conn, "store_fingerprints", owns_transaction)
     except Exception as e:
         print(f"An error occurred while storing fingerprints for '{song_name}': {e}")
-        conn.rollback()
+        _rollback_savepoint(conn, "store_fingerprints", owns_transaction)
 
 
 # --- Fingerprinting Functions ---
@@ -96,17 +169,21 @@ def generate_fingerprints(
     noverlap: int = NOVERLAP_VAL,
     peak_neighborhood_size: int = PEAK_NEIGHBORHOOD_SIZE_VAL,
     hash_fan_value: int = HASH_FAN_VALUE_VAL,
-    hash_time_window: int = HASH_TIME_WINDOW_VAL
-) -> List[Tuple[str, int]]:
+    hash_time_window: int = HASH_TIME_WINDOW_VAL,
+    target_sr: int = TARGET_SR_VAL
+) -> List[Tuple[int, int]]:
     """
     Generates audio fingerprints from an audio file.
     Returns an empty list if an error occurs or no fingerprints can be generated.
     """
     try:
-        y, sr = librosa.load(audio_path, mono=True, duration=30.0)
+        y, sr = librosa.load(audio_path, sr=target_sr, mono=True, duration=30.0, res_type='soxr_hq')
         if y is None or len(y) == 0:
             print(f"Warning: Audio file {audio_path} loaded as empty or None. Cannot generate fingerprints.")
             return []
+        if not np.any(y):
+            print(f"Warning: Audio file {audio_path} is silent. Cannot generate fingerprints.")
+            return []
     except FileNotFoundError:
         print(f"Error: Audio file not found at {audio_path}")
         return []
@@ -115,78 +192,227 @@ def generate_fingerprints(
         return []
 
     try:
-        spectrogram, _, _ = mlab.specgram(y, NFFT=nfft, Fs=sr, noverlap=noverlap)
+        # Power spectrogram (freq bins x frames); librosa's STFT reuses cached FFT plans.
+        stft_matrix = librosa.stft(y, n_fft=nfft, hop_length=nfft - noverlap, window='hann', center=False)
+        # float32 halves the bytes touched by the memory-bound peak filter below.
+        spectrogram = np.abs(stft_matrix).astype(np.float32, copy=False)
+        del stft_matrix
+        np.square(spectrogram, out=spectrogram)
 
         if spectrogram is None or spectrogram.size == 0:
             print(f"Warning: Spectrogram for {audio_path} is empty. Cannot generate fingerprints.")
             return []
 
+        # Convert to dB in place to avoid spectrogram-sized temporaries.
         epsilon = 1e-10 
-        log_spectrogram = 10 * np.log10(spectrogram + epsilon)
+        np.add(spectrogram, epsilon, out=spectrogram)
+        np.log10(spectrogram, out=spectrogram)
+        spectrogram *= 10
 
-        peaks = get_peaks(log_spectrogram, peak_neighborhood_size)
-        if peaks.size == 0: # Check if peaks array is empty
+        peak_freqs, peak_times = get_peaks(spectrogram, peak_neighborhood_size)
+        if peak_freqs.size == 0: # Check if no peaks were found
             print(f"Warning: No peaks found in {audio_path}. Cannot generate fingerprints.")
             return []
             
-        hashes = generate_hashes(peaks, fan_value=hash_fan_value, time_window=hash_time_window)
+        hashes = generate_hashes(peak_freqs, peak_times, fan_value=hash_fan_value, time_window=hash_time_window)
         return hashes
     except Exception as e:
         print(f"Error generating fingerprints for {audio_path}: {e}")
         return []
 
 
-def get_peaks(spectrogram: np.ndarray, neighborhood_size: int) -> np.ndarray:
+if numba is not None:
+    @numba.njit(cache=True, parallel=True)
+    def _peak_mask_njit(spectrogram, radius, amp_min):
+        """
+        Fused peak detection, equivalent to the scipy path in get_peaks: a separable
+        (2r+1)x(2r+1) running maximum (van Herk/Gil-Werman, O(N) per axis with -inf
+        padding, i.e. a clipped window at the borders), compared and gated in one pass.
+        Only one spectrogram-sized scratch array is allocated; the time-axis pass works on
+        chunks of frequency rows so every inner loop runs over contiguous memory.
+        """
+        n_freqs, n_times = spectrogram.shape
+        window = 2 * radius + 1
+
+        # Pass 1: running max along frequency, one frame per iteration. Stored transposed
+        # (frame, freq) so the time-axis pass below reads contiguous row chunks.
+        freq_max = np.empty((n_times, n_freqs), spectrogram.dtype)
+        for t in numba.prange(n_times):
+            n_padded = n_freqs + 2 * radius
+            padded = np.full(n_padded, -np.inf, spectrogram.dtype)
+            for f in range(n_freqs):
+                padded[f + radius] = spectrogram[f, t]
+            prefix = np.empty(n_padded, spectrogram.dtype)
+            suffix = np.empty(n_padded, spectrogram.dtype)
+            for i in range(n_padded):
+                prefix[i] = padded[i] if i % window == 0 else max(prefix[i - 1], padded[i])
+            suffix[n_padded - 1] = padded[n_padded - 1]
+            for i in range(n_padded - 2, -1, -1):
+                suffix[i] = padded[i] if i % window == window - 1 else max(suffix[i + 1], padded[i])
+            for f in range(n_freqs):
+                freq_max[t, f] = max(suffix[f], prefix[f + window - 1])
+
+        # Pass 2: running max along time over chunks of frequency rows, fused with the
+        # local-maximum comparison and the amplitude gate.
+        mask = np.empty((n_times, n_freqs), np.bool_)
+        chunk = 64
+        for c in numba.prange((n_freqs + chunk - 1) // chunk):
+            f0 = c * chunk
+            rows = min(n_freqs, f0 + chunk) - f0
+            n_padded = n_times + 2 * radius
+            padded = np.full((n_padded, rows), -np.inf, spectrogram.dtype)
+            for t in range(n_times):
+                for r in range(rows):
+                    padded[t + radius, r] = freq_max[t, f0 + r]
+            prefix = np.empty((n_padded, rows), spectrogram.dtype)
+            suffix = np.empty((n_padded, rows), spectrogram.dtype)
+            for i in range(n_padded):
+                if i % window == 0:
+                    prefix[i, :] = padded[i, :]
+                else:
+                    for r in range(rows):
+                        prefix[i, r] = max(prefix[i - 1, r], padded[i, r])
+            suffix[n_padded - 1, :] = padded[n_padded - 1, :]
+            for i in range(n_padded - 2, -1, -1):
+                if i % window == window - 1:
+                    suffix[i, :] = padded[i, :]
+                else:
+                    for r in range(rows):
+                        suffix[i, r] = max(suffix[i + 1, r], padded[i, r])
+            for t in range(n_times):
+                for r in range(rows):
+                    value = spectrogram[f0 + r, t]
+                    mask[t, f0 + r] = (value == max(suffix[t, r], prefix[t + window - 1, r])) & (value > amp_min)
+        return mask.T
+else:
+    _peak_mask_njit = None
+
+
+def get_peaks(spectrogram: np.ndarray, neighborhood_size: int, amp_range_db: float = PEAK_AMP_RANGE_DB_VAL) -> Tuple[np.ndarray, np.ndarray]:
     """
     Identifies peaks in the spectrogram.
-    Returns an empty ndarray if spectrogram is empty or no peaks are found.
+    Returns (freq_indices, time_indices) as contiguous int32 arrays, ordered by frequency
+    then time. Both are empty if spectrogram is empty or no peaks are found.
+    Uses the fused Numba kernel when Numba is installed.
     """
     if spectrogram is None or spectrogram.size == 0:
-        return np.array([])
+        return np.array([], dtype=np.int32), np.array([], dtype=np.int32)
+
+    # Amplitude gate: drops the flat "maxima" found in silent regions without a
+    # second morphological pass over the spectrogram. The gate never sits below the
+    # noise floor, so a flat (e.g. silent) spectrogram yields no peaks at all.
+    amp_min = max(spectrogram.max() - amp_range_db, spectrogram.min())
+
+    # A square maximum filter is separable into two O(N) 1-D passes, unlike the diamond
+    # footprint, which costs O(N * footprint) per call. The square is sized to the same
+    # area as the radius-n diamond (radius n / sqrt(2)) so peak density is unchanged.
+    radius = int(round(neighborhood_size / np.sqrt(2)))
+    if _peak_mask_njit is not None:
+        detected_peaks = _peak_mask_njit(spectrogram, radius, amp_min)
+    else:
+        window = 2 * radius + 1
+        neighborhood_max = scipy.ndimage.maximum_filter1d(spectrogram, size=window, axis=0)
+        neighborhood_max = scipy.ndimage.maximum_filter1d(neighborhood_max, size=window, axis=1)
+        detected_peaks = (neighborhood_max == spectrogram) & (spectrogram > amp_min)
+    
+    # int32 coordinates halve the bytes the pairing stage has to sort and scan.
+    freq_idx, time_idx = np.nonzero(detected_peaks)
+    return freq_idx.astype(np.int32), time_idx.astype(np.int32)
 
-    struct = scipy.ndimage.generate_binary_structure(2, 1)
-    neighborhood = scipy.ndimage.iterate_structure(struct, neighborhood_size)
 
-    local_max = scipy.ndimage.maximum_filter(spectrogram, footprint=neighborhood) == spectrogram
-    
-    background = (spectrogram == np.min(spectrogram)) 
-    eroded_background = scipy.ndimage.binary_erosion(background, structure=neighborhood, border_value=1)
-    
-    detected_peaks = local_max ^ eroded_background
-    
-    peaks = np.argwhere(detected_peaks) 
-    return peaks
+def pack_hash(freq1: Any, freq2: Any, time_diff: Any) -> Any:
+    """
+    Packs a (freq1, freq2, time_diff) landmark into a single 64-bit integer hash.
+    Each field gets HASH_FIELD_BITS_VAL bits, so distinct landmarks never collide.
+    Accepts Python ints or int64 ndarrays (packed element-wise).
+    """
+    mask = (1 << HASH_FIELD_BITS_VAL) - 1
+    return ((freq1 & mask) << (2 * HASH_FIELD_BITS_VAL)) | ((freq2 & mask) << HASH_FIELD_BITS_VAL) | (time_diff & mask)
 
 
-def generate_hashes(peaks: np.ndarray, fan_value: int, time_window: int) -> List[Tuple[str, int]]:
+def _pair_peaks_numpy(freqs: np.ndarray, times: np.ndarray, fan_value: int, time_window: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pairs time-sorted peaks with NumPy, one vectorized lane per fan-out offset.
+    Returns (hashes, anchor_offsets) as int64 ndarrays.
+    """
+    # Pair every peak with the peak k positions ahead of it, one vectorized lane per k.
+    # Times are sorted, so this matches pairing each anchor with its next fan_value peaks.
+    hash_lanes: List[np.ndarray] = []
+    offset_lanes: List[np.ndarray] = []
+    for k in range(1, min(fan_value, len(times) - 1) + 1):
+        time_diffs = times[k:] - times[:-k]
+        in_window = (time_diffs > 0) & (time_diffs <= time_window)
+        hash_lanes.append(pack_hash(freqs[:-k][in_window], freqs[k:][in_window], time_diffs[in_window]))
+        offset_lanes.append(times[:-k][in_window])
+    if not hash_lanes: # No lanes to pair (e.g. fan_value <= 0); match the Numba kernel's empty result
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    return np.concatenate(hash_lanes), np.concatenate(offset_lanes)
+
+
+if numba is not None:
+    @numba.njit(cache=True, parallel=True)
+    def _pair_peaks_njit(freqs, times, fan_value, time_window, field_bits):
+        """
+        Numba version of _pair_peaks_numpy. A first parallel pass counts the pairs of
+        each anchor so the output can be preallocated; a second pass fills it.
+        """
+        n = len(times)
+        mask = (1 << field_bits) - 1
+        counts = np.zeros(n, np.int64)
+        for i in numba.prange(n):
+            count = 0
+            for j in range(i + 1, min(i + 1 + fan_value, n)):
+                time_diff = times[j] - times[i]
+                if time_diff > time_window:
+                    break
+                if time_diff > 0:
+                    count += 1
+            counts[i] = count
+
+        starts = np.zeros(n + 1, np.int64)
+        starts[1:] = np.cumsum(counts)
+        hashes = np.empty(starts[n], np.int64)
+        offsets = np.empty(starts[n], np.int64)
+        for i in numba.prange(n):
+            pos = starts[i]
+            for j in range(i + 1, min(i + 1 + fan_value, n)):
+                time_diff = times[j] - times[i]
+                if time_diff > time_window:
+                    break
+                if time_diff > 0:
+                    hashes[pos] = ((freqs[i] & mask) << (2 * field_bits)) | ((freqs[j] & mask) << field_bits) | (time_diff & mask)
+                    offsets[pos] = times[i]
+                    pos += 1
+        return hashes, offsets
+else:
+    _pair_peaks_njit = None
+
+
+def generate_hashes(freqs: np.ndarray, times: np.ndarray, fan_value: int, time_window: int) -> List[Tuple[int, int]]:
     """
     Generates hash values from the identified peaks by pairing them.
+    Peaks are given as parallel frequency and time index arrays, ordered by frequency
+    then time as returned by get_peaks.
+    Uses the Numba pairing kernel when Numba is installed.
     """
-    hashes: List[Tuple[str, int]] = []
+    hashes: List[Tuple[int, int]] = []
         
-    # Ensure peaks is a 2D array with shape (num_peaks, 2) and has at least 2 peaks for pairing.
-    if not isinstance(peaks, np.ndarray) or peaks.ndim != 2 or peaks.shape[1] != 2 or peaks.shape[0] < 2:
+    # Ensure the peak arrays are 1D, the same length, and hold at least 2 peaks for pairing.
+    if freqs.ndim != 1 or freqs.shape != times.shape or freqs.shape[0] < 2:
         return hashes
 
-    # Sort by time (peaks[:,1]), then by frequency (peaks[:,0]) for consistent pairing
-    peaks_sorted = peaks[np.lexsort((peaks[:, 0], peaks[:, 1]))]
+    # Sort by time, then by frequency for consistent pairing. get_peaks already orders
+    # frequency-major, so a stable sort on time alone is enough.
+    order = np.argsort(times, kind='stable')
+    freqs = freqs[order].astype(np.int64)
+    times = times[order].astype(np.int64)
 
-    for i in range(len(peaks_sorted)):
-        anchor_peak_time = int(peaks_sorted[i][1])
-        anchor_peak_freq = int(peaks_sorted[i][0])
-        
-        for j in range(i + 1, min(i + 1 + fan_value, len(peaks_sorted))):
-            target_peak_time = int(peaks_sorted[j][1])
-            target_peak_freq = int(peaks_sorted[j][0])
-            
-            time_diff = target_peak_time - anchor_peak_time
-            
-            if 0 < time_diff <= time_window:
-                hash_input = f"{anchor_peak_freq}|{target_peak_freq}|{time_diff}"
-                hash_output = hashlib.sha1(hash_input.encode('utf-8')).hexdigest()
-                hashes.append((hash_output, anchor_peak_time))
-            elif time_diff > time_window: 
-                break 
+    if _pair_peaks_njit is not None:
+        hash_values, offsets = _pair_peaks_njit(freqs, times, fan_value, time_window, HASH_FIELD_BITS_VAL)
+    else:
+        hash_values, offsets = _pair_peaks_numpy(freqs, times, fan_value, time_window)
+
+    hashes = list(zip(hash_values.tolist(), offsets.tolist()))
     return hashes
 
 # --- Recognition Function ---
@@ -202,7 +428,8 @@ def recognize_audio(conn: sqlite3.Connection, audio_path: str) -> None:
         noverlap=NOVERLAP_VAL,
         peak_neighborhood_size=PEAK_NEIGHBORHOOD_SIZE_VAL,
         hash_fan_value=HASH_FAN_VALUE_VAL,
-        hash_time_window=HASH_TIME_WINDOW_VAL
+        hash_time_window=HASH_TIME_WINDOW_VAL,
+        target_sr=TARGET_SR_VAL
     )
 
     if not sample_hashes:
@@ -211,46 +438,47 @@ def recognize_audio(conn: sqlite3.Connection, audio_path: str) -> None:
 
     c = conn.cursor()
     
-    query_hashes_list = [h[0] for h in sample_hashes]
-
-    placeholders = ','.join(['?'] * len(query_hashes_list))
-    sql = f"SELECT hash, song_id, offset FROM fingerprints WHERE hash IN ({placeholders})"
-    
+    # Look the sample hashes up through a temp table JOIN rather than a giant IN (...)
+    # list: the statement text stays constant, there is no bound-parameter limit, and each
+    # row probes the fingerprints index directly. Carrying the sample offset through the
+    # JOIN also removes the need for a Python-side hash -> offsets map.
+    # The scratch rows live in a savepoint that is always rolled back, whatever is raised,
+    # so they never outlive this call and recognition never commits or rolls back a
+    # transaction the caller may have open.
     try:
-        c.execute(sql, query_hashes_list)
+        _ensure_scratch_tables(c)
+        c.execute("SAVEPOINT recognize_audio")
+    except sqlite3.Error as e:
+        print(f"Database error during recognition query: {e}")
+        return
+    db_matches = None
+    try:
+        c.execute("DELETE FROM query_hashes")
+        c.executemany("INSERT INTO query_hashes (hash, offset) VALUES (?, ?)", sample_hashes)
+        c.execute("SELECT f.song_id, f.offset, q.offset FROM query_hashes q "
+                  "JOIN fingerprints f ON f.hash = q.hash")
         db_matches = c.fetchall()
     except sqlite3.Error as e:
         print(f"Database error during recognition query: {e}")
+    finally:
+        _rollback_savepoint(conn, "recognize_audio", owns_transaction=False)
+    if db_matches is None:
         return
 
     if not db_matches:
         print("No fingerprints from this sample were found in the database.")
         return
 
-    sample_hash_map: Dict[str, List[int]] = {}
-    for h_val, h_offset in sample_hashes:
-        h_offset_int = int(h_offset)
-        if h_val not in sample_hash_map:
-            sample_hash_map[h_val] = []
-        sample_hash_map[h_val].append(h_offset_int)
-
-    match_counts: Dict[Tuple[int, int], int] = {}
-
-    for db_hash, song_id, db_offset_val in db_matches:
-        db_offset = int(db_offset_val)
-        if db_hash in sample_hash_map:
-            for sample_offset in sample_hash_map[db_hash]:
-                time_difference = db_offset - sample_offset
-                key = (song_id, time_difference)
-                match_counts[key] = match_counts.get(key, 0) + 1
-            
-    if not match_counts:
-        print("No consistent song matches found after time alignment (unexpected).")
-        return
+    # Histogram the (song_id, time_difference) alignments at C speed: pack each pair into
+    # one int64 key (song_id in the high 32 bits) and count the unique keys.
+    matches = np.array(db_matches, dtype=np.int64)
+    time_differences = matches[:, 1] - matches[:, 2]
+    packed_keys = (matches[:, 0] << 32) | (time_differences & 0xFFFFFFFF)
+    alignment_keys, alignment_counts = np.unique(packed_keys, return_counts=True)
 
-    best_match_key, best_match_count = max(match_counts.items(), key=lambda item: item[1])
-    
-    matched_song_id = best_match_key[0]
+    best_index = int(alignment_counts.argmax())
+    best_match_count = int(alignment_counts[best_index])
+    matched_song_id = int(alignment_keys[best_index] >> 32)
 
     c.execute("SELECT name FROM songs WHERE id = ?", (matched_song_id,))
     song_name_tuple = c.fetchone()
@@ -261,6 +489,36 @@ def recognize_audio(conn: sqlite3.Connection, audio_path: str) -> None:
         print(f"Error: Could not find song name for recognized ID: {matched_song_id}. Database might be inconsistent.")
 
 
+# --- Batch Ingest ---
+
+def _init_batch_worker() -> None:
+    """
+    Runs once in each batch worker process. Each worker already owns a core, so Numba's
+    parallel kernels are limited to one thread to avoid cpu_count x cpu_count threads.
+    """
+    if numba is not None:
+        numba.set_num_threads(1)
+
+
+def add_songs_batch(conn: sqlite3.Connection, song_paths: List[str]) -> None:
+    """
+    Fingerprints several songs in parallel worker processes and stores them in the database.
+    Each song is named after its file name without the extension. All database writes
+    happen in this process, since SQLite allows only one writer at a time.
+    """
+    song_names = [os.path.splitext(os.path.basename(path))[0] for path in song_paths]
+    # 'spawn' rather than the Linux default 'fork': forking after Numba's threading layer
+    # (TBB/OpenMP) has started in this process can hang or abort the workers.
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_batch_worker) as executor:
+        for song_name, hashes in zip(song_names, executor.map(generate_fingerprints, song_paths)):
+            if hashes:
+                store_fingerprints(conn, song_name, hashes)
+                print(f"Song '{song_name}' and its fingerprints have been processed.")
+            else:
+                print(f"Could not generate fingerprints for '{song_name}'. Song not added.")
+
+
 # --- Main Application Logic ---
 
 def main():
@@ -276,8 +534,9 @@ def main():
             print("-----------------------------")
             print("1. Add a song to the database")
             print("2. Recognize an audio sample")
-            print("3. Exit")
-            choice = input("Enter your choice (1-3): ").strip()
+            print("3. Add all songs in a directory")
+            print("4. Exit")
+            choice = input("Enter your choice (1-4): ").strip()
 
             if choice == '1':
                 song_path = input("Enter the path to the song file (e.g., /path/to/song.mp3): ").strip()
@@ -293,7 +552,8 @@ def main():
                         noverlap=NOVERLAP_VAL,
                         peak_neighborhood_size=PEAK_NEIGHBORHOOD_SIZE_VAL,
                         hash_fan_value=HASH_FAN_VALUE_VAL,
-                        hash_time_window=HASH_TIME_WINDOW_VAL
+                        hash_time_window=HASH_TIME_WINDOW_VAL,
+                        target_sr=TARGET_SR_VAL
                     )
                     if hashes:
                         store_fingerprints(conn, song_name, hashes)
@@ -314,10 +574,26 @@ def main():
                     print(f"An unexpected error occurred during recognition of '{sample_path}': {e}")
 
             elif choice == '3':
+                songs_dir = input("Enter the path to the directory of song files: ").strip()
+                if not songs_dir or not os.path.isdir(songs_dir):
+                    print("Error: Please enter an existing directory.")
+                    continue
+                song_paths = [os.path.join(songs_dir, file_name) for file_name in sorted(os.listdir(songs_dir))
+                              if file_name.lower().endswith(AUDIO_EXTENSIONS_VAL)]
+                if not song_paths:
+                    print(f"No audio files ({', '.join(AUDIO_EXTENSIONS_VAL)}) found in '{songs_dir}'.")
+                    continue
+                try:
+                    print(f"Processing {len(song_paths)} songs from '{songs_dir}'...")
+                    add_songs_batch(conn, song_paths)
+                except Exception as e: 
+                    print(f"An unexpected error occurred while adding songs from '{songs_dir}': {e}")
+
+            elif choice == '4':
                 print("Exiting application.")
                 break
             else:
-                print("Invalid choice. Please enter a number between 1 and 3.")
+                print("Invalid choice. Please enter a number between 1 and 4.")
     except sqlite3.Error as e:
         print(f"A critical database error occurred: {e}. Please check the database file '{DB_NAME_VAL}'.")
     except Exception as e: